@@ -5,7 +5,9 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, TEXT, UpdateOne
+from pymongo.collation import Collation
 from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
@@ -18,15 +20,78 @@ load_dotenv()
 _client = None
 db = None
 
+# Case-insensitive collation (ignores case, respects accents) for equality lookups
+CASE_INSENSITIVE = Collation(locale="en", strength=2)
+
+# Index hint forcing a collection scan, cheaper than any index for unselective filters
+NATURAL_ORDER = [("$natural", ASCENDING)]
+
+# Source fields mirrored into lowercase "<field>_lc" shadows (computed in schemas.py)
+# so that searches can use an anchored, case-sensitive prefix regex which MongoDB
+# serves from a B-tree index
+SHADOW_FIELDS = {
+    "song": ("title", "artist", "genre"),
+    "playlist": ("name",),
+    "channel": ("name", "genre"),
+}
+
+# Shadows that lead a compound index, which already serves them on their own
+_COMPOUND_PREFIX_SHADOWS = {("song", "genre")}
+
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
 if database_url and database_name:
-    _client = MongoClient(database_url)
+    _client = AsyncIOMotorClient(database_url)
     db = _client[database_name]
 
+async def ensure_indexes():
+    """Create search indexes and backfill lowercase shadow fields (run once at startup)"""
+    if db is None:
+        return
+
+    await db["song"].create_index([("genre", ASCENDING)], name="genre_1", collation=CASE_INSENSITIVE)
+    await db["channel"].create_index([("genre", ASCENDING)], name="genre_1", collation=CASE_INSENSITIVE)
+
+    # Equality on genre, then a prefix range on title or artist
+    await db["song"].create_index([("genre_lc", ASCENDING), ("title_lc", ASCENDING)], name="genre_lc_1_title_lc_1")
+    await db["song"].create_index([("genre_lc", ASCENDING), ("artist_lc", ASCENDING)], name="genre_lc_1_artist_lc_1")
+
+    # Inverted indexes backing ranked keyword search ($text)
+    await db["song"].create_index(
+        [("title", TEXT), ("artist", TEXT), ("album", TEXT), ("genre", TEXT)], name="search_text"
+    )
+    await db["channel"].create_index(
+        [("name", TEXT), ("description", TEXT), ("genre", TEXT)], name="search_text"
+    )
+
+    for collection_name, fields in SHADOW_FIELDS.items():
+        for field in fields:
+            shadow = f"{field}_lc"
+            if (collection_name, field) not in _COMPOUND_PREFIX_SHADOWS:
+                await db[collection_name].create_index([(shadow, ASCENDING)], name=f"{shadow}_1")
+            await _backfill_shadow(collection_name, field, shadow)
+
+async def _backfill_shadow(collection_name: str, field: str, shadow: str, batch: int = 1000):
+    """Fill a missing shadow field on documents written before it existed
+
+    Lowercased in Python rather than with $toLower, which is only defined for
+    ASCII, so backfilled values match the schemas and query.lower().
+    """
+    cursor = db[collection_name].find(
+        {shadow: {"$exists": False}, field: {"$type": "string"}}, {field: 1}
+    )
+    ops = []
+    async for doc in cursor:
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {shadow: doc[field].lower()}}))
+        if len(ops) >= batch:
+            await db[collection_name].bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        await db[collection_name].bulk_write(ops, ordered=False)
+
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -40,16 +105,49 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     data_dict['created_at'] = datetime.now(timezone.utc)
     data_dict['updated_at'] = datetime.now(timezone.utc)
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
-    """Get documents from collection"""
+async def create_documents(collection_name: str, items: list, ordered: bool = False):
+    """Insert many documents with timestamps in a single round trip
+
+    Unordered by default so the server may apply the inserts in parallel and
+    keep going past individual failures.
+    """
+    if db is None:
+        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    now = datetime.now(timezone.utc)
+    docs = []
+    for data in items:
+        data_dict = data.model_dump() if isinstance(data, BaseModel) else data.copy()
+        data_dict['created_at'] = now
+        data_dict['updated_at'] = now
+        docs.append(data_dict)
+
+    result = await db[collection_name].insert_many(docs, ordered=ordered)
+    return [str(oid) for oid in result.inserted_ids]
+
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None, collation: Collation = None, hint=None, projection: dict = None, sort: list = None):
+    """Get documents from collection, optionally pinning the query plan with an index hint"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
     
-    cursor = db[collection_name].find(filter_dict or {})
+    cursor = db[collection_name].find(filter_dict or {}, projection, collation=collation)
+    if hint:
+        cursor = cursor.hint(hint)
+    if sort:
+        cursor = cursor.sort(sort)
     if limit:
-        cursor = cursor.limit(limit)
+        # Fetch everything in the first batch so no getMore round trip follows
+        cursor = cursor.limit(limit).batch_size(limit)
     
-    return list(cursor)
+    return await cursor.to_list(length=limit or None)
+
+def serialize_documents(docs: list):
+    """Replace each document's ObjectId "_id" with a string "id", in place"""
+    for d in docs:
+        oid = d.pop("_id", None)
+        if oid is not None:
+            d["id"] = str(oid)
+    return docs
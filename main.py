@@ -1,13 +1,26 @@
+import asyncio
+import logging
 import os
-from fastapi import FastAPI, HTTPException
+import re
+import time
+from functools import lru_cache
+from bson import ObjectId, Regex
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from fast_cache_middleware import FastCacheMiddleware, CacheConfig, CacheDropConfig, InMemoryStorage
+from pydantic import BaseModel, TypeAdapter
+from typing import List, Optional, Dict, Any, Tuple
 
-from database import create_document, get_documents, db
+from database import ensure_indexes, create_document, create_documents, get_documents, serialize_documents, db, CASE_INSENSITIVE, NATURAL_ORDER
 from schemas import Song as SongSchema, Playlist as PlaylistSchema, Channel as ChannelSchema
 
-app = FastAPI(title="Vibe Music API")
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="Vibe Music API", default_response_class=ORJSONResponse)
+
+# Unanchored "contains" search; cannot use an index range, so off by default
+SUBSTRING_SEARCH = os.getenv("SUBSTRING_SEARCH", "").lower() in ("1", "true", "yes")
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,49 +30,130 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Response cache for list endpoints; the key covers path and query string, and
+# writes drop the cached entries of the collection they touch (drop paths are
+# matched as prefixes)
+class _ResponseCache(InMemoryStorage):
+    # FastCacheMiddleware does `storage or InMemoryStorage()`, and an empty
+    # storage is falsy through __len__, so it would be silently replaced
+    def __bool__(self) -> bool:
+        return True
+
+_response_cache = _ResponseCache()
+app.add_middleware(FastCacheMiddleware, storage=_response_cache)
+# fast-cache-middleware 0.0.7 logs every cache miss as an ERROR
+# ("Couldn't get the cache: Data not found"), which would flood server.log
+logging.getLogger("fast_cache_middleware.controller").setLevel(logging.CRITICAL)
+
+async def _drop_cached(prefix: str):
+    """Drop cached responses under prefix again once a write has completed
+
+    CacheDropConfig invalidates before the handler runs, so a GET served while
+    the write is still in flight would otherwise re-cache the old list.
+    """
+    await _response_cache.delete(re.compile("^" + re.escape(prefix)))
+
+# Process-lifetime facts reported by /test
+_DB_URL_SET = bool(os.getenv("DATABASE_URL"))
+_DB_NAME_SET = bool(os.getenv("DATABASE_NAME"))
+_COLLECTIONS_CACHE: Optional[List[str]] = None
+
+async def _collection_names() -> List[str]:
+    global _COLLECTIONS_CACHE
+    if _COLLECTIONS_CACHE is None:
+        _COLLECTIONS_CACHE = await db.list_collection_names()
+    return _COLLECTIONS_CACHE
+
+@app.on_event("startup")
+async def startup():
+    if db is None:
+        return
+    # Query hints and $text search depend on these indexes; refuse to serve without them
+    await ensure_indexes()
+    try:
+        await _collection_names()
+    except Exception:
+        # Non-fatal: /test retries the lookup on its next call
+        logger.exception("Could not list collections")
+
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Vibe Music API running"}
 
+# Autocomplete sends the same short prefixes over and over
+@lru_cache(maxsize=1024)
+def _prefix_regex(text: str) -> Regex:
+    """Case-sensitive match against a lowercase "<field>_lc" shadow, anchored unless SUBSTRING_SEARCH is on"""
+    pattern = re.escape(text.lower())
+    if SUBSTRING_SEARCH:
+        return Regex(pattern)
+    return Regex("^" + pattern)
+
+# Fields returned by the list endpoints; shadow fields and timestamps stay in MongoDB
+SONG_FIELDS = {"title": 1, "artist": 1, "album": 1, "cover_url": 1, "audio_url": 1, "genre": 1, "duration_sec": 1}
+PLAYLIST_FIELDS = {"name": 1, "description": 1, "song_ids": 1}
+CHANNEL_FIELDS = {"name": 1, "stream_url": 1, "genre": 1, "description": 1}
+
+NEWEST_FIRST = [("_id", -1)]
+
 # ---------- SONGS ----------
-class SongCreate(BaseModel):
-    title: str
-    artist: str
-    album: Optional[str] = None
-    cover_url: Optional[str] = None
-    audio_url: Optional[str] = None
-    duration_sec: Optional[int] = None
-    genre: Optional[str] = None
-
-@app.get("/api/songs")
-def list_songs(query: Optional[str] = None, genre: Optional[str] = None, limit: int = 50):
+# Request bodies are validated straight into the collection schemas, and the
+# module-level adapters reuse one compiled serializer for every write
+SongCreate = SongSchema
+_SONG_ADAPTER = TypeAdapter(SongSchema)
+
+@app.get("/api/songs", dependencies=[CacheConfig(max_age=30)])
+async def list_songs(query: Optional[str] = None, genre: Optional[str] = None, limit: int = Query(50, ge=0)):
     try:
+        if not query and not genre:
+            # Home feed: walk the _id index backwards and stop after one batch
+            docs = await get_documents("song", {}, limit, projection=SONG_FIELDS, sort=NEWEST_FIRST)
+            serialize_documents(docs)
+            return {"items": docs}
+        if query and genre:
+            # One seek per genre/prefix compound index instead of an $or, run
+            # concurrently and merged with title matches first
+            prefix = _prefix_regex(query)
+            genre_lc = genre.lower()
+            by_title, by_artist = await asyncio.gather(
+                get_documents("song", {"genre_lc": genre_lc, "title_lc": prefix}, limit,
+                              hint="genre_lc_1_title_lc_1", projection=SONG_FIELDS),
+                get_documents("song", {"genre_lc": genre_lc, "artist_lc": prefix}, limit,
+                              hint="genre_lc_1_artist_lc_1", projection=SONG_FIELDS),
+            )
+            merged = {d["_id"]: d for d in by_title}
+            for d in by_artist:
+                merged.setdefault(d["_id"], d)
+            docs = list(merged.values())
+            if limit:
+                # limit=0 means "no limit", as in get_documents
+                docs = docs[:limit]
+            serialize_documents(docs)
+            return {"items": docs}
         filter_q: Dict[str, Any] = {}
+        collation = None
+        hint = None
         if query:
-            # Simple case-insensitive search across title and artist
-            filter_q = {
-                "$or": [
-                    {"title": {"$regex": query, "$options": "i"}},
-                    {"artist": {"$regex": query, "$options": "i"}},
-                ]
-            }
-        if genre:
-            filter_q["genre"] = {"$regex": f"^{genre}$", "$options": "i"}
-        docs = get_documents("song", filter_q, limit)
-        # Convert ObjectId to str if present
-        for d in docs:
-            if "_id" in d:
-                d["id"] = str(d["_id"])
-                del d["_id"]
+            # Prefix search across title and artist, served from the *_lc indexes;
+            # left unhinted so each $or clause can pick its own index
+            prefix = _prefix_regex(query)
+            filter_q["$or"] = [{"title_lc": prefix}, {"artist_lc": prefix}]
+        else:
+            # Case-insensitive equality via the collated genre index
+            filter_q["genre"] = genre
+            collation = CASE_INSENSITIVE
+            hint = "genre_1"
+        docs = await get_documents("song", filter_q, limit, collation=collation, hint=hint, projection=SONG_FIELDS)
+        serialize_documents(docs)
         return {"items": docs}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/songs")
-def create_song(payload: SongCreate):
+@app.post("/api/songs", dependencies=[CacheDropConfig(paths=["/api/songs"])])
+async def create_song(payload: SongCreate):
     try:
-        song = SongSchema(**payload.model_dump())
-        new_id = create_document("song", song)
+        new_id = await create_document("song", _SONG_ADAPTER.dump_python(payload))
+        await _drop_cached("/api/songs")
         return {"id": new_id, "message": "Song added"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -73,105 +167,160 @@ class PlaylistAddSong(BaseModel):
     playlist_id: str
     song_id: str
 
-@app.get("/api/playlists")
-def list_playlists(limit: int = 50):
+@app.get("/api/playlists", dependencies=[CacheConfig(max_age=300)])
+async def list_playlists(limit: int = Query(50, ge=0)):
     try:
-        docs = get_documents("playlist", {}, limit)
-        for d in docs:
-            if "_id" in d:
-                d["id"] = str(d["_id"])
-                del d["_id"]
+        docs = await get_documents("playlist", {}, limit, projection=PLAYLIST_FIELDS)
+        serialize_documents(docs)
         return {"items": docs}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/playlists")
-def create_playlist(payload: PlaylistCreate):
+@app.post("/api/playlists", dependencies=[CacheDropConfig(paths=["/api/playlists"])])
+async def create_playlist(payload: PlaylistCreate):
     try:
         playlist = PlaylistSchema(name=payload.name, description=payload.description, song_ids=[])
-        new_id = create_document("playlist", playlist)
+        new_id = await create_document("playlist", playlist)
+        await _drop_cached("/api/playlists")
         return {"id": new_id, "message": "Playlist created"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/playlists/add")
-def add_song_to_playlist(payload: PlaylistAddSong):
+@app.post("/api/playlists/add", dependencies=[CacheDropConfig(paths=["/api/playlists"])])
+async def add_song_to_playlist(payload: PlaylistAddSong):
+    if not ObjectId.is_valid(payload.song_id):
+        raise HTTPException(status_code=400, detail="Invalid song id")
     try:
         if db is None:
             raise Exception("Database not available")
-        db["playlist"].update_one({"_id": {"$eq": db["playlist"].find_one({"_id": {"$exists": True}, "_id": {"$type": "objectId"}}) }}, {})
-        # Simpler: find by string id match stored in a custom field 'id' or fallback to ObjectId string compare
-        from bson import ObjectId
-        try:
-            oid = ObjectId(payload.playlist_id)
-            db["playlist"].update_one({"_id": oid}, {"$addToSet": {"song_ids": payload.song_id}})
-        except Exception:
+        # Canonical lowercase hex, so $addToSet sees one spelling per song
+        update = {"$addToSet": {"song_ids": str(ObjectId(payload.song_id))}}
+        if ObjectId.is_valid(payload.playlist_id):
+            await db["playlist"].update_one({"_id": ObjectId(payload.playlist_id)}, update)
+        else:
             # If playlist_id isn't a valid ObjectId, try match via stored string 'id' field (if any)
-            db["playlist"].update_one({"id": payload.playlist_id}, {"$addToSet": {"song_ids": payload.song_id}})
+            await db["playlist"].update_one({"id": payload.playlist_id}, update)
+        await _drop_cached("/api/playlists")
         return {"ok": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# ObjectId() re-validates its hex string; song ids repeat across playlists
+@lru_cache(maxsize=8192)
+def _object_id(value: str) -> Optional[ObjectId]:
+    return ObjectId(value) if ObjectId.is_valid(value) else None
+
+@app.get("/api/playlists/{pid}/tracks", dependencies=[CacheConfig(max_age=300)])
+async def list_playlist_tracks(pid: str):
+    """Expand a playlist's song_ids into songs with a single $in query, in playlist order"""
+    try:
+        if db is None:
+            raise Exception("Database not available")
+        oid = _object_id(pid)
+        query = {"_id": oid} if oid is not None else {"id": pid}
+        playlist = await db["playlist"].find_one(query, {"song_ids": 1})
+        if playlist is None:
+            raise HTTPException(status_code=404, detail="Playlist not found")
+        song_ids = playlist.get("song_ids", [])
+        oids = [o for o in map(_object_id, song_ids) if o is not None]
+        docs = await get_documents("song", {"_id": {"$in": oids}}, projection=SONG_FIELDS) if oids else []
+        # Keyed by ObjectId so any hex spelling of a stored id resolves
+        by_oid = {d["_id"]: d for d in docs}
+        serialize_documents(docs)
+        return {"items": [by_oid[o] for o in oids if o in by_oid]}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # ---------- CHANNELS (FM) ----------
-class ChannelCreate(BaseModel):
-    name: str
-    description: Optional[str] = None
-    stream_url: str
-    genre: Optional[str] = None
+ChannelCreate = ChannelSchema
+_CHANNEL_ADAPTER = TypeAdapter(ChannelSchema)
+
+# Per-process cache of the first page of the unfiltered channel list; the set is
+# small and rarely changes, so a short TTL keeps MongoDB off the hot path.
+# One slot holding (expires_at, items); smaller limits are served as slices
+_CHANNEL_CACHE_TTL = 60.0
+_CHANNEL_CACHE_LIMIT = 50
+_channel_cache: Optional[Tuple[float, list]] = None
+_seeded = False
+
+# Channels inserted by /api/channels/seed, validated once at import
+_DEFAULT_CHANNELS = [
+    ChannelSchema(**ch).model_dump()
+    for ch in [
+        {
+            "name": "Lofi Beats FM",
+            "description": "Chill lofi for focus",
+            "stream_url": "https://streams.ilovemusic.de/iloveradio9.mp3",
+            "genre": "lofi",
+        },
+        {
+            "name": "Classic Rock FM",
+            "description": "Rock anthems 24/7",
+            "stream_url": "https://stream.revma.ihrhls.com/zc1469",  # example
+            "genre": "rock",
+        },
+        {
+            "name": "Jazz Lounge",
+            "description": "Smooth jazz and lounge",
+            "stream_url": "https://us4.internet-radio.com/proxy/club107?mp=/stream",
+            "genre": "jazz",
+        },
+    ]
+]
+
+def _invalidate_channels():
+    global _channel_cache
+    _channel_cache = None
 
-@app.get("/api/channels")
-def list_channels(genre: Optional[str] = None, limit: int = 50):
+@app.get("/api/channels", dependencies=[CacheConfig(max_age=600)])
+async def list_channels(genre: Optional[str] = None, limit: int = Query(50, ge=0)):
+    global _channel_cache
     try:
+        cacheable = genre is None and 0 < limit <= _CHANNEL_CACHE_LIMIT
+        if cacheable:
+            if _channel_cache and _channel_cache[0] > time.monotonic():
+                return {"items": _channel_cache[1][:limit]}
         filter_q: Dict[str, Any] = {}
         if genre:
-            filter_q["genre"] = {"$regex": f"^{genre}$", "$options": "i"}
-        docs = get_documents("channel", filter_q, limit)
-        for d in docs:
-            if "_id" in d:
-                d["id"] = str(d["_id"])
-                del d["_id"]
+            filter_q["genre"] = genre
+        hint = "genre_1" if genre else NATURAL_ORDER
+        fetch_limit = _CHANNEL_CACHE_LIMIT if cacheable else limit
+        docs = await get_documents("channel", filter_q, fetch_limit, collation=CASE_INSENSITIVE, hint=hint, projection=CHANNEL_FIELDS)
+        serialize_documents(docs)
+        if cacheable:
+            _channel_cache = (time.monotonic() + _CHANNEL_CACHE_TTL, docs)
+            docs = docs[:limit]
         return {"items": docs}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/channels")
-def create_channel(payload: ChannelCreate):
+@app.post("/api/channels", dependencies=[CacheDropConfig(paths=["/api/channels"])])
+async def create_channel(payload: ChannelCreate):
     try:
-        channel = ChannelSchema(**payload.model_dump())
-        new_id = create_document("channel", channel)
+        new_id = await create_document("channel", _CHANNEL_ADAPTER.dump_python(payload))
+        _invalidate_channels()
+        await _drop_cached("/api/channels")
         return {"id": new_id, "message": "Channel added"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/channels/seed")
-def seed_channels():
+@app.post("/api/channels/seed", dependencies=[CacheDropConfig(paths=["/api/channels"])])
+async def seed_channels():
+    global _seeded
     try:
+        if _seeded:
+            return {"message": "Channels already seeded"}
         if db is None:
             raise Exception("Database not available")
-        if db["channel"].count_documents({}) > 0:
+        if await db["channel"].count_documents({}) > 0:
+            _seeded = True
             return {"message": "Channels already seeded"}
-        defaults = [
-            {
-                "name": "Lofi Beats FM",
-                "description": "Chill lofi for focus",
-                "stream_url": "https://streams.ilovemusic.de/iloveradio9.mp3",
-                "genre": "lofi",
-            },
-            {
-                "name": "Classic Rock FM",
-                "description": "Rock anthems 24/7",
-                "stream_url": "https://stream.revma.ihrhls.com/zc1469",  # example
-                "genre": "rock",
-            },
-            {
-                "name": "Jazz Lounge",
-                "description": "Smooth jazz and lounge",
-                "stream_url": "https://us4.internet-radio.com/proxy/club107?mp=/stream",
-                "genre": "jazz",
-            },
-        ]
-        for ch in defaults:
-            create_document("channel", ChannelSchema(**ch))
+        await create_documents("channel", _DEFAULT_CHANNELS)
+        _seeded = True
+        _invalidate_channels()
+        await _drop_cached("/api/channels")
         return {"message": "Seeded default channels"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -180,8 +329,46 @@ def seed_channels():
 class VoiceCommand(BaseModel):
     transcript: str
 
+# Intent keywords scanned in one pass; the anchored lookahead gives a channel
+# keyword anywhere in the transcript priority over an earlier song keyword
+_INTENT_RE = re.compile(
+    r"^(?=.*?(?P<channel>play channel|open channel|play radio|open radio|\bfm\b))"
+    r"|(?P<song>play song|find song|search song|\bsearch\b|\bplay\b|\bfind\b)",
+    re.I | re.S,
+)
+
+# Command words stripped from a transcript in one pass, leaving the search keyword;
+# song titles may contain channel words ("Radio Ga Ga"), so each intent has its own set
+_CHANNEL_STRIP_RE = re.compile(
+    r"\b(play channel|open channel|play radio|open radio|play|open|channel|radio|fm)\b",
+    re.I,
+)
+_SONG_STRIP_RE = re.compile(r"\b(play song|find song|search song|search|play|find)\b", re.I)
+
+def _strip_command(text: str, pattern: re.Pattern) -> str:
+    return " ".join(pattern.sub(" ", text).split())
+
+# Keywords shorter than this are too weak for the text index and use prefix matching
+TEXT_SEARCH_MIN_LEN = 3
+TEXT_SCORE_SORT = [("score", {"$meta": "textScore"})]
+
+async def _keyword_search(collection_name: str, keyword: str, prefix_fields, projection: dict, limit: int):
+    """Ranked $text search, falling back to *_lc prefix matching for short or unmatched keywords"""
+    if not keyword:
+        return await get_documents(collection_name, {}, limit, hint=NATURAL_ORDER, projection=projection)
+    if len(keyword) >= TEXT_SEARCH_MIN_LEN:
+        items = await get_documents(
+            collection_name, {"$text": {"$search": keyword}}, limit, projection=projection, sort=TEXT_SCORE_SORT
+        )
+        if items:
+            return items
+    prefix = _prefix_regex(keyword)
+    return await get_documents(
+        collection_name, {"$or": [{field: prefix} for field in prefix_fields]}, limit, projection=projection
+    )
+
 @app.post("/api/ai/command")
-def ai_command(cmd: VoiceCommand):
+async def ai_command(cmd: VoiceCommand):
     """
     Very simple intent parser:
     - "find song ..." / "play song ..."
@@ -192,48 +379,30 @@ def ai_command(cmd: VoiceCommand):
     if not t:
         return {"action": "none", "message": "I didn't catch that."}
 
+    m = _INTENT_RE.search(t)
+    intent = m.lastgroup if m else None
+
     # Channel intent
-    if any(k in t for k in ["play channel", "open channel", "play radio", "open radio", "fm"]):
+    if intent == "channel":
         # find by genre or name keyword
-        keyword = t.replace("play", "").replace("open", "").replace("channel", "").replace("radio", "").replace("fm", "").strip()
-        f: Dict[str, Any] = {}
-        if keyword:
-            f = {"$or": [
-                {"name": {"$regex": keyword, "$options": "i"}},
-                {"genre": {"$regex": keyword, "$options": "i"}},
-            ]}
-        items = get_documents("channel", f, 5)
-        for d in items:
-            if "_id" in d:
-                d["id"] = str(d["_id"])
-                del d["_id"]
+        keyword = _strip_command(t, _CHANNEL_STRIP_RE)
+        items = await _keyword_search("channel", keyword, ("name_lc", "genre_lc"), CHANNEL_FIELDS, 5)
+        serialize_documents(items)
         return {"action": "play_channel", "items": items, "message": f"Found {len(items)} channel(s)"}
 
     # Song intent
-    if any(k in t for k in ["play song", "find song", "play", "find", "search"]):
+    if intent == "song":
         # extract possible title/artist after keywords
-        keywords = t
-        for k in ["play song", "find song", "search song", "search", "play"]:
-            keywords = keywords.replace(k, "")
-        query = keywords.strip()
-        f: Dict[str, Any] = {}
-        if query:
-            f = {"$or": [
-                {"title": {"$regex": query, "$options": "i"}},
-                {"artist": {"$regex": query, "$options": "i"}},
-            ]}
-        items = get_documents("song", f, 10)
-        for d in items:
-            if "_id" in d:
-                d["id"] = str(d["_id"])
-                del d["_id"]
+        query = _strip_command(t, _SONG_STRIP_RE)
+        items = await _keyword_search("song", query, ("title_lc", "artist_lc"), SONG_FIELDS, 10)
+        serialize_documents(items)
         return {"action": "play_song", "items": items, "message": f"Found {len(items)} song(s)"}
 
     return {"action": "none", "message": "Try: 'Play channel jazz' or 'Find song by Coldplay'"}
 
 
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -249,7 +418,7 @@ def test_database():
             response["database_name"] = db.name if hasattr(db, 'name') else "✅ Connected"
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
+                collections = await _collection_names()
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -259,8 +428,8 @@ def test_database():
     except Exception as e:
         response["database"] = f"❌ Error: {str(e)[:50]}"
 
-    response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
-    response["database_name"] = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
+    response["database_url"] = "✅ Set" if _DB_URL_SET else "❌ Not Set"
+    response["database_name"] = "✅ Set" if _DB_NAME_SET else "❌ Not Set"
     return response
 
 
@@ -7,11 +7,18 @@ Collection name is the lowercase of the class name.
 - Song -> "song"
 - Playlist -> "playlist"
 - Channel -> "channel"
+
+Fields ending in "_lc" are lowercase shadows of their source field, computed
+on every dump so they are stored alongside it and can be prefix-searched
+through a plain index.
 """
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, computed_field
 from typing import Optional, List
 
+def _lower(value: Optional[str]) -> Optional[str]:
+    return value.lower() if value is not None else None
+
 class Song(BaseModel):
     """
     Songs collection schema
@@ -24,6 +31,21 @@ class Song(BaseModel):
     duration_sec: Optional[int] = Field(None, ge=0, description="Duration in seconds")
     genre: Optional[str] = Field(None, description="Music genre")
 
+    @computed_field
+    @property
+    def title_lc(self) -> str:
+        return self.title.lower()
+
+    @computed_field
+    @property
+    def artist_lc(self) -> str:
+        return self.artist.lower()
+
+    @computed_field
+    @property
+    def genre_lc(self) -> Optional[str]:
+        return _lower(self.genre)
+
 class Playlist(BaseModel):
     """
     Playlists collection schema
@@ -32,6 +54,11 @@ class Playlist(BaseModel):
     description: Optional[str] = Field(None, description="Short description")
     song_ids: List[str] = Field(default_factory=list, description="List of Song document IDs")
 
+    @computed_field
+    @property
+    def name_lc(self) -> str:
+        return self.name.lower()
+
 class Channel(BaseModel):
     """
     FM/Radio channels collection schema
@@ -40,3 +67,13 @@ class Channel(BaseModel):
     description: Optional[str] = Field(None, description="What this channel plays")
     stream_url: str = Field(..., description="Streaming URL (mp3/aac/m3u8)")
     genre: Optional[str] = Field(None, description="Channel genre")
+
+    @computed_field
+    @property
+    def name_lc(self) -> str:
+        return self.name.lower()
+
+    @computed_field
+    @property
+    def genre_lc(self) -> Optional[str]:
+        return _lower(self.genre)